@@ -1,25 +1,472 @@
 import json
 import base64
+import httpx
+import openai
 from openai import OpenAI, AsyncOpenAI
 import io
 from typing import Any, AsyncGenerator
 import inspect
 import asyncio
+import hashlib
+import os
+import time
+from email.utils import parsedate_to_datetime
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    # optional faster json decoder
+    import orjson
+except ImportError:
+    orjson = None
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_JPEG_SIGNATURE = b"\xff\xd8\xff"
+_PNG_URL_PREFIX = b"data:image/png;base64,"
+_JPEG_URL_PREFIX = b"data:image/jpeg;base64,"
+_STREAM_MAX_BATCH = 64
+# gaps between streamed chunks (prefill, model loading) may take much longer than connecting
+_STREAM_READ_TIMEOUT = 600.0
+_RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.ConflictError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+_THINK_OPEN = "<think>"
+_THINK_CLOSE = "</think>"
+_JSON_TYPES = {
+    "str": "string",
+    "int": "integer",
+    "float": "number",
+    "bool": "boolean",
+    "list": "array",
+    "dict": "object"
+}
+
+
+def _json_loads(data: str):
+    """decode json with orjson if installed, input only the stdlib accepts (NaN, > 64 bit ints) falls back to json.loads"""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+def _tool_schema(func) -> dict:
+    """build an openai style tool definition from a python callable"""
+    name = func.__name__.strip()
+    doc = (func.__doc__ or "").strip()
+    param = func.__annotations__
+    required_params = []
+    parameters = {}
+    for k, v in param.items():
+        if k == "return":
+            continue
+        else:
+            type_name = getattr(v, "__name__", None)
+            if type_name is None:
+                type_name = str(v).split("[", 1)[0].replace("typing.", "").lower()
+            parameters[str(k)] = {"type": _JSON_TYPES.get(type_name, "string")}
+    return {
+        "type": "function",
+        "function": {
+            "name": name,
+            "description": doc,
+            "parameters": {
+                "type": "object",
+                "properties": parameters,
+                "required": required_params
+            }
+        }
+    }
+
+
+# optional dependencies, imported on first use
+_PIL_IMAGE = None
+_LMS = None
+_LMS_BASE_URL = None
+_OXIPNG = None
+
+
+def _get_pil():
+    """return PIL.Image, imported on first use"""
+    global _PIL_IMAGE
+    if _PIL_IMAGE is None:
+        from PIL import Image
+        _PIL_IMAGE = Image
+    return _PIL_IMAGE
+
+
+def _get_lms(base_url: str):
+    """return the lmstudio module, imported and configured on first use"""
+    global _LMS, _LMS_BASE_URL
+    if _LMS is None:
+        import lmstudio
+        lmstudio.configure_default_client(base_url)
+        _LMS = lmstudio
+        _LMS_BASE_URL = base_url
+    elif base_url != _LMS_BASE_URL:
+        # lmstudio only has one default client per process
+        raise RuntimeError(
+            f"lmstudio default client is already configured for {_LMS_BASE_URL}, cannot use it for {base_url}"
+        )
+    return _LMS
+
+
+def _get_oxipng():
+    """return the optional oxipng module, or None if it is not installed"""
+    global _OXIPNG
+    if _OXIPNG is None:
+        try:
+            import oxipng
+            _OXIPNG = oxipng
+        except ImportError:
+            _OXIPNG = False
+    return _OXIPNG or None
+
+
+def _to_data_url(prefix: bytes, data) -> str:
+    """base64 encode bytes / a memoryview into a data url, decoding to str only once at the end"""
+    return (prefix + base64.b64encode(data)).decode("ascii")
+
+
+def _encode_pil(img) -> str:
+    """encode a PIL image as base64 data url (jpeg for opaque rgb / grayscale images, png otherwise)"""
+    buffer = io.BytesIO()
+    if img.mode in ("RGB", "L") and "transparency" not in img.info:
+        img.save(buffer, format="JPEG", quality=90, optimize=True)
+        return _to_data_url(_JPEG_URL_PREFIX, buffer.getbuffer())
+    oxipng = _get_oxipng()
+    if oxipng is None:
+        img.save(buffer, format="PNG")
+        data = buffer.getbuffer()
+    else:
+        # fast zlib pass, oxipng does the actual compression
+        img.save(buffer, format="PNG", optimize=False, compress_level=1)
+        data = oxipng.optimize_from_memory(buffer.getvalue(), level=2)
+    return _to_data_url(_PNG_URL_PREFIX, data)
+
+
+def _pil_cache_key(img) -> tuple:
+    """cache key for a PIL image, based on a hash of its pixel data"""
+    hasher = hashlib.blake2b(img.tobytes(), digest_size=16)
+    if img.mode == "P":
+        hasher.update(bytes(img.getpalette() or []))
+    # the transparency key decides jpeg vs png and is written into the png, so it has to be part of the key
+    hasher.update(repr(img.info.get("transparency")).encode())
+    return "pil", img.mode, img.size, hasher.hexdigest()
+
+
+def _path_cache_key(path: str) -> tuple:
+    """cache key for an image file, modified files get a new key"""
+    return "path", path, os.path.getmtime(path)
+
+
+def _path_to_data_url(path: str) -> str:
+    """encode an image file as base64 data url (png / jpeg files are passed through)"""
+    with open(path, "rb") as f:
+        raw = f.read()
+    if raw.startswith(_PNG_SIGNATURE):
+        return _to_data_url(_PNG_URL_PREFIX, raw)
+    if raw.startswith(_JPEG_SIGNATURE):
+        return _to_data_url(_JPEG_URL_PREFIX, raw)
+    with _get_pil().open(io.BytesIO(raw)) as img:
+        return _encode_pil(img)
+
+
+def _http_timeout(request_timeout: float = None):
+    """request_timeout for connecting / sending, with a longer read timeout for the stream itself"""
+    if request_timeout is None:
+        return None
+    return httpx.Timeout(request_timeout, read=max(request_timeout, _STREAM_READ_TIMEOUT))
+
+
+def _retry_after(error: Exception):
+    """seconds requested by a retry-after(-ms) header, or None if missing / unusable"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    delay = None
+    try:
+        if headers.get("retry-after-ms"):
+            delay = float(headers["retry-after-ms"]) / 1000
+        elif headers.get("retry-after"):
+            value = headers["retry-after"]
+            try:
+                delay = float(value)
+            except ValueError:
+                delay = parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return None
+    # same bounds the openai sdk accepts
+    if delay is None or not 0 < delay <= 60:
+        return None
+    return delay
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """seconds to wait before retrying, honours retry-after on status errors, otherwise backs off exponentially"""
+    if isinstance(error, openai.APIStatusError):
+        delay = _retry_after(error)
+        return delay if delay is not None else min(0.5 * 2 ** attempt, 8.0)
+    # timeouts / connection errors
+    return min(0.25 * 2 ** attempt, 4.0)
+
+
+def _iter_completion(completion):
+    """iterate a completion stream, timeouts while streaming are raised like failed requests"""
+    try:
+        yield from completion
+    except (httpx.TimeoutException, openai.APITimeoutError) as e:
+        raise RuntimeError(f"Model stream timed out: {e}")
+
+
+async def _aiter_completion(completion):
+    """iterate an async completion stream, timeouts while streaming are raised like failed requests"""
+    try:
+        async for chunk in completion:
+            yield chunk
+    except (httpx.TimeoutException, openai.APITimeoutError) as e:
+        raise RuntimeError(f"Async model stream timed out: {e}")
+
+
+def _run_tool(func, arguments: dict):
+    """call a tool with the arguments the model produced"""
+    return func(**arguments)
+
+
+async def _async_run_tool(tool_call: dict, func, in_thread: bool = True) -> tuple[dict, Any, Exception]:
+    """await a tool (sync tools run in a worker thread unless in_thread is False), returns (tool_call, result, error)"""
+    try:
+        if inspect.iscoroutinefunction(func):
+            result = await func(**tool_call["arguments"])
+        elif in_thread:
+            result = await asyncio.to_thread(_run_tool, func, tool_call["arguments"])
+        else:
+            result = _run_tool(func, tool_call["arguments"])
+        return tool_call, result, None
+    except Exception as e:
+        return tool_call, None, e
+
+
+class _DataUrlCache:
+    """small lru cache for encoded image data urls"""
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self.data: "OrderedDict[tuple, str]" = OrderedDict()
+
+    def get(self, key: tuple):
+        url = self.data.pop(key, None)
+        if url is not None:
+            self.data[key] = url
+        return url
+
+    def put(self, key: tuple, url: str):
+        if self.maxsize <= 0:
+            return
+        self.data[key] = url
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
+
+
+class _StreamBatcher:
+    """groups consecutive streamed deltas of the same type into larger chunks"""
+    def __init__(self, batch_size: int = 1, growth: float = 3.0, flush_ms: int = 50):
+        self.batch_size = max(1, batch_size)
+        self.growth = growth
+        self.flush_interval = flush_ms / 1000
+        self.kind = None
+        self.parts = []
+        self.last_flush = time.monotonic()
+
+    def _flush(self, now: float) -> dict:
+        chunk = {"type": self.kind, "content": "".join(self.parts)}
+        self.parts = []
+        self.last_flush = now
+        return chunk
+
+    def add(self, kind: str, content: str) -> list[dict]:
+        """buffer a delta, returns the chunks that are ready to be yielded"""
+        now = time.monotonic()
+        ready = []
+        if self.parts and kind != self.kind:
+            ready.append(self._flush(now))
+        self.kind = kind
+        self.parts.append(content)
+        if len(self.parts) >= self.batch_size or now - self.last_flush >= self.flush_interval:
+            ready.append(self._flush(now))
+            self.batch_size = min(_STREAM_MAX_BATCH, max(self.batch_size, int(self.batch_size * self.growth)))
+        return ready
+
+    def poll(self) -> list[dict]:
+        """flush buffered text once flush_ms passed, called for every upstream chunk (also tool call / hidden ones)"""
+        now = time.monotonic()
+        if self.parts and now - self.last_flush >= self.flush_interval:
+            return [self._flush(now)]
+        return []
+
+    def flush(self) -> list[dict]:
+        """return whatever is still buffered"""
+        return [self._flush(time.monotonic())] if self.parts else []
+
+
+class _ThinkSplitter:
+    """splits streamed content at <think> / </think> tags, also when a tag spans several deltas"""
+    def __init__(self):
+        self.inside_think = False
+        self.carry = ""
+
+    def feed(self, content: str) -> list[tuple[bool, str]]:
+        """returns (inside_think, text) segments, a possibly partial tag at the end is held back"""
+        if not self.carry and "<" not in content:
+            # fast path, plain text can't contain a tag
+            return [(self.inside_think, content)]
+        buf = self.carry + content
+        self.carry = ""
+        segments = []
+        pos = 0
+        while True:
+            i = buf.find(_THINK_OPEN, pos)
+            j = buf.find(_THINK_CLOSE, pos)
+            if i == -1 and j == -1:
+                break
+            if j == -1 or (i != -1 and i < j):
+                idx, tag_len, inside = i, len(_THINK_OPEN), True
+            else:
+                idx, tag_len, inside = j, len(_THINK_CLOSE), False
+            if idx > pos:
+                segments.append((self.inside_think, buf[pos:idx]))
+            self.inside_think = inside
+            pos = idx + tag_len
+
+        # only a suffix starting at the last "<" can be the beginning of a tag
+        k = buf.rfind("<", max(pos, len(buf) - len(_THINK_CLOSE) + 1))
+        if k != -1 and (_THINK_OPEN.startswith(buf[k:]) or _THINK_CLOSE.startswith(buf[k:])):
+            self.carry = buf[k:]
+        else:
+            k = len(buf)
+        if k > pos:
+            segments.append((self.inside_think, buf[pos:k]))
+        return segments
+
+    def flush(self) -> list[tuple[bool, str]]:
+        """returns the held back text once the stream has ended"""
+        carry, self.carry = self.carry, ""
+        return [(self.inside_think, carry)] if carry else []
+
 
 class LLM:
     """Universal api wrapper for LLM models with openai compatible api (e.g., LM Studio)"""
     def __init__(self, model: str, vllm_mode: bool = False, api_key: str = "lm-studio",
-                 base_url: str = "http://localhost:1234/v1"):
+                 base_url: str = "http://localhost:1234/v1", request_timeout: float = 15.0, max_retries: int = 2,
+                 image_cache_size: int = 128):
         """initialize the wrapper"""
-        self.client = OpenAI(base_url=base_url, api_key=api_key)
-        self.async_client = AsyncOpenAI(base_url=base_url, api_key=api_key)
+        # retries (timeouts, connection errors, 409 / 429 / 5xx) are handled by the wrapper itself
+        timeout = _http_timeout(request_timeout)
+        self.client = OpenAI(base_url=base_url, api_key=api_key, timeout=timeout, max_retries=0)
+        self.async_client = AsyncOpenAI(base_url=base_url, api_key=api_key, timeout=timeout, max_retries=0)
         self.model = model
         self.base_url = base_url
         self.api_key = api_key
         self.vllm_mode = vllm_mode
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        # weak keys, so per-turn closures / lambdas don't pile up and tools are not kept alive
+        self._tool_schema_cache: "weakref.WeakKeyDictionary[Any, dict]" = weakref.WeakKeyDictionary()
+        self._lms_model = None
+        self._image_cache = _DataUrlCache(image_cache_size)
+
+    def _translate_tools(self, tools: list = None) -> tuple[list, dict]:
+        """convert callables in tools to tool definitions, returns (tool definitions, callables by name)"""
+        _tools = []
+        callable_tools = {}
+        for tool in (tools or []):
+            if callable(tool):
+                # bound methods are created per attribute access, cache on the underlying function
+                key = getattr(tool, "__func__", tool)
+                try:
+                    schema = self._tool_schema_cache.get(key)
+                except TypeError:
+                    # not hashable / weak referenceable, translate without caching
+                    key = schema = None
+                if schema is None:
+                    schema = _tool_schema(tool)
+                    if key is not None:
+                        self._tool_schema_cache[key] = schema
+                callable_tools[schema["function"]["name"]] = tool
+                _tools.append(schema)
+            elif isinstance(tool, dict):
+                _tools.append(tool)
+            else:
+                raise ValueError("tools must be a list of callables or dicts")
+        return _tools, callable_tools
+
+    def _cached_image_url(self, key_func, encode_func, source) -> str:
+        """encode an image via encode_func, reusing the cached data url if caching is enabled"""
+        if self._image_cache.maxsize <= 0:
+            return encode_func(source)
+        key = key_func(source)
+        url = self._image_cache.get(key)
+        if url is None:
+            url = encode_func(source)
+            self._image_cache.put(key, url)
+        return url
+
+    def _rewrite_image(self, c: dict) -> dict:
+        """convert an {"type": "image", ...} content part to an openai image_url part"""
+        if "image_path" in c:
+            url = self._cached_image_url(_path_cache_key, _path_to_data_url, c["image_path"])
+            return {
+                "type": "image_url",
+                "image_url": {"url": url}
+            }
+        elif "image_pil" in c:
+            url = self._cached_image_url(_pil_cache_key, _encode_pil, c["image_pil"])
+            return {
+                "type": "image_url",
+                "image_url": {"url": url}
+            }
+        elif "image_url" in c:
+            url_data = c["image_url"]
+            if isinstance(url_data, str):
+                url_data = {"url": url_data}
+            return {"type": "image_url", "image_url": url_data}
+        return c
+
+    def _prepare_messages(self, messages: list[dict]) -> list[dict]:
+        """return the messages to send, in vllm_mode image parts are rebuilt without touching the caller's dicts"""
+        if not self.vllm_mode:
+            return messages
+        return [
+            {**msg, "content": [self._rewrite_image(c) if c["type"] == "image" else c for c in msg["content"]]}
+            if isinstance(msg.get("content"), list) else msg
+            for msg in messages
+        ]
+
+    def _completion_kwargs(self, messages: list[dict], tools: list, output_format: dict = None,
+                           request_timeout: float = None) -> dict:
+        """build the keyword arguments for chat.completions.create"""
+        kwargs = {
+            "model": self.model,
+            "messages": messages,
+            "stream": True,
+            "tools": tools,
+        }
+        if output_format is not None:
+            kwargs["response_format"] = output_format
+        if request_timeout is not None:
+            kwargs["timeout"] = _http_timeout(request_timeout)
+        return kwargs
 
     def response(self, messages: list[dict[str, Any]] = None, output_format: dict = None, tools: list = None,
-                 lm_studio_unload_model: bool = False, hide_thinking: bool = True):
+                 lm_studio_unload_model: bool = False, hide_thinking: bool = True, request_timeout: float = None,
+                 max_retries: int = None):
         """request model inference"""
 
         if messages is None:
@@ -32,6 +479,8 @@ class LLM:
             tools=tools,
             lm_studio_unload_model=lm_studio_unload_model,
             hide_thinking=hide_thinking,
+            request_timeout=request_timeout,
+            max_retries=max_retries,
         )
 
         for r in response:
@@ -39,174 +488,115 @@ class LLM:
                 return r["content"]
 
     def stream_response(self, messages: list[dict] = None, output_format: dict = None, final: bool = False, tools: list = None,
-                        lm_studio_unload_model: bool = False, hide_thinking: bool = True):
+                        lm_studio_unload_model: bool = False, hide_thinking: bool = True, request_timeout: float = None,
+                        max_retries: int = None, stream_batch_size: int = 1, stream_batch_growth: float = 3.0,
+                        stream_flush_ms: int = 50):
         """request model inference"""
-        _tools = list(tools) if tools else []
-        callable_tools = {}
-        if _tools:
-            types = {
-                "str": "string",
-                "int": "integer",
-                "float": "number",
-                "bool": "boolean",
-                "list": "array",
-                "dict": "object"
-            }
-            for i in range(len(_tools)):
-                if callable(_tools[i]):
-                    func=_tools[i]
-                    name = func.__name__.strip()
-                    callable_tools[name] = func
-                    doc = (func.__doc__ or "").strip()
-                    param = func.__annotations__
-                    required_params = []
-                    parameters = {}
-                    for k, v in param.items():
-                        if k == "return":
-                            continue
-                        else:
-                            type_name = getattr(v, "__name__", None)
-                            if type_name is None:
-                                type_name = str(v).split("[", 1)[0].replace("typing.", "").lower()
-                            parameters[str(k)] = {"type": types.get(type_name, "string")}
-                    _tools[i] = {
-                        "type": "function",
-                        "function": {
-                            "name": name,
-                            "description": doc,
-                            "parameters": {
-                                "type": "object",
-                                "properties": parameters,
-                                "required": required_params
-                            }
-                        }
-                    }
-                elif isinstance(_tools[i], dict):
-                    continue
-                else:
-                    raise ValueError("tools must be a list of callables or dicts")
+        _tools, callable_tools = self._translate_tools(tools)
 
         if messages is None:
             raise ValueError("messages must be provided")
 
-        if self.vllm_mode:
-            from PIL import Image
-            for msg in messages:
-                for i in range(len(msg["content"])):
-                    c = msg["content"][i]
-                    if c["type"] == "image":
-                        if "image_path" in c:
-                            with Image.open(c["image_path"]) as img:
-                                buffer = io.BytesIO()
-                                img.save(buffer, format="PNG")
-                            img_b64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
-                            msg["content"][i] = {
-                                "type": "image_url",
-                                "image_url": {"url": f"data:image/png;base64,{img_b64}"}
-                            }
-                        elif "image_pil" in c:
-                            img = c["image_pil"]
-                            buffer = io.BytesIO()
-                            img.save(buffer, format="PNG")
-                            img_b64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
-                            msg["content"][i] = {
-                                "type": "image_url",
-                                "image_url": {"url": f"data:image/png;base64,{img_b64}"}
-                            }
-                        elif "image_url" in c:
-                            url_data = c["image_url"]
-                            if isinstance(url_data, str):
-                                url_data = {"url": url_data}
-                            msg["content"][i] = {"type": "image_url", "image_url": url_data}
+        messages = self._prepare_messages(messages)
 
         if lm_studio_unload_model:
-            import lmstudio as lms
-            lms.configure_default_client(self.base_url)
+            lms = _get_lms(self.base_url)
             all_loaded_models = lms.list_loaded_models()
-            for loaded_model in (all_loaded_models or []):
-                if loaded_model.identifier != self.model:
-                    loaded_model.unload()
+            stale = [m for m in (all_loaded_models or []) if m.identifier != self.model]
+            if stale:
+                with ThreadPoolExecutor(max_workers=min(8, len(stale))) as executor:
+                    list(executor.map(lambda m: m.unload(), stale))
 
         structured_output = output_format is not None
+        request_timeout = self.request_timeout if request_timeout is None else request_timeout
+        max_retries = self.max_retries if max_retries is None else max_retries
+        create_kwargs = self._completion_kwargs(messages, _tools, output_format, request_timeout)
 
-        if structured_output:
-            try:
-                completion = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    stream=True,
-                    tools=tools if tools is not None else [],
-                    response_format=output_format if output_format is not None else None,
-                )
-            except Exception as e:
-                raise RuntimeError(f"Model request failed: {e}")
-        else:
+        for attempt in range(max_retries + 1):
             try:
-                completion = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    stream=True,
-                    tools=tools if tools is not None else [],
-                )
+                completion = self.client.chat.completions.create(**create_kwargs)
+                break
+            except _RETRYABLE_ERRORS as e:
+                if attempt == max_retries:
+                    raise RuntimeError(f"Model request failed after {attempt + 1} attempts: {e}")
+                time.sleep(_retry_delay(e, attempt))
             except Exception as e:
                 raise RuntimeError(f"Model request failed: {e}")
 
-        thinking = ""
-        answer = ""
-        tool_calls_accumulator = {}
-        inside_think = False
+        thinking_parts = []
+        answer_parts = []
+        tool_names: dict[str, str] = {}
+        tool_arg_chunks: dict[str, list[str]] = {}
+        tool_ids_by_index = {}
+        splitter = _ThinkSplitter()
+        batcher = _StreamBatcher(stream_batch_size, stream_batch_growth, stream_flush_ms)
 
-        for chunk in completion:
+        for chunk in _iter_completion(completion):
+            yield from batcher.poll()
             x = chunk.choices[0].delta
             if not x:
                 continue
 
+            # content / tool_calls are always present on openai deltas, reasoning is provider specific
+            content = x.content
+            tool_calls = x.tool_calls
             reasoning = getattr(x, "reasoning", None)
-            content = getattr(x, "content", None)
-            tool_calls = getattr(x, "tool_calls", None)
 
-            if not (content or tool_calls or reasoning):
+            if content is None and tool_calls is None and reasoning is None:
                 continue
 
             if content:
-                if "<think>" in str(content):
-                    inside_think = True
-                    content = str(content).replace("<think>", "")
-                if "</think>" in str(content):
-                    inside_think = False
-                    content = str(content).replace("</think>", "")
-                if inside_think:
-                    thinking += str(content)
-                    if not hide_thinking:
-                        yield {"type": "reasoning", "content": str(content)}
-                else:
-                    answer += str(content)
-                    if not structured_output:
-                        yield {"type": "answer", "content": str(content)}
+                for in_think, text in splitter.feed(str(content)):
+                    if in_think:
+                        thinking_parts.append(text)
+                        if not hide_thinking:
+                            yield from batcher.add("reasoning", text)
+                    else:
+                        answer_parts.append(text)
+                        if not structured_output:
+                            yield from batcher.add("answer", text)
 
             if reasoning:
-                thinking += reasoning
+                thinking_parts.append(reasoning)
                 if not hide_thinking:
-                    yield {"type": "reasoning", "content": reasoning}
+                    yield from batcher.add("reasoning", reasoning)
 
             if tool_calls:
                 for tool_call in tool_calls:
-                    tool_id = tool_call.id or "0"
+                    # the id is usually only sent with the first fragment of a call
+                    tool_id = tool_call.id or tool_ids_by_index.get(tool_call.index) or "0"
+                    tool_ids_by_index[tool_call.index] = tool_id
                     funct = tool_call.function
-                    if tool_id not in tool_calls_accumulator:
-                        tool_calls_accumulator[tool_id] = {"name": funct.name or "", "arguments": ""}
+                    chunks = tool_arg_chunks.get(tool_id)
+                    if chunks is None:
+                        chunks = tool_arg_chunks[tool_id] = []
+                        tool_names[tool_id] = ""
                     if funct.name:
-                        tool_calls_accumulator[tool_id]["name"] = funct.name
+                        tool_names[tool_id] = funct.name
                     if funct.arguments:
                         args_val = funct.arguments
                         if isinstance(args_val, dict):
                             args_val = json.dumps(args_val)
-                        tool_calls_accumulator[tool_id]["arguments"] += args_val or ""
+                        chunks.append(args_val)
+
+        for in_think, text in splitter.flush():
+            if in_think:
+                thinking_parts.append(text)
+                if not hide_thinking:
+                    yield from batcher.add("reasoning", text)
+            else:
+                answer_parts.append(text)
+                if not structured_output:
+                    yield from batcher.add("answer", text)
+        yield from batcher.flush()
+
+        thinking = "".join(thinking_parts)
+        answer = "".join(answer_parts)
 
         if structured_output:
             temp_answer = answer
             try:
-                data = json.loads(answer)
+                data = _json_loads(answer)
             except json.JSONDecodeError:
                 try:
                     decoded = answer.encode('utf-8').decode('unicode_escape')
@@ -216,36 +606,61 @@ class LLM:
             answer = data
             yield {"type": "answer", "content": answer}
 
-        final_tool_calls = []
-        for tool_id, data in tool_calls_accumulator.items():
+        final_tool_calls = [None] * len(tool_arg_chunks)
+        for i, (tool_id, chunks) in enumerate(tool_arg_chunks.items()):
+            args_str = "".join(chunks)
             try:
-                args = json.loads(data["arguments"] or "{}")
+                args = _json_loads(args_str or "{}")
             except json.JSONDecodeError:
-                args = {"_raw": data["arguments"] or ""}
-            final_tool_calls.append({"id": tool_id, "name": data["name"], "arguments": args})
+                args = {"_raw": args_str}
+            final_tool_calls[i] = {"id": tool_id, "name": tool_names[tool_id], "arguments": args}
 
-        for tool_call in final_tool_calls[:]:
-            tool_name = tool_call["name"]
+        runnable_tool_calls = [tc for tc in final_tool_calls if tc["name"] in callable_tools]
+        final_tool_calls = [tc for tc in final_tool_calls if tc["name"] not in callable_tools]
 
-            if tool_name in callable_tools:
-                try:
-                    func_to_call = callable_tools[tool_name]
-                    result = func_to_call(**tool_call["arguments"])
+        for tool_call in final_tool_calls:
+            yield {"type": "tool_call", "content": tool_call}
+
+        if len(runnable_tool_calls) == 1:
+            # a single tool runs inline, so thread-affine tools (e.g. sqlite connections) keep working
+            tool_call = runnable_tool_calls[0]
+            tool_name = tool_call["name"]
+            try:
+                result = _run_tool(callable_tools[tool_name], tool_call["arguments"])
+            except Exception as e:
+                print(f"Error executing tool {tool_name}: {e}")
+            else:
+                yield {
+                    "type": "tool_result",
+                    "content": {
+                        "id": tool_call["id"],
+                        "name": tool_name,
+                        "result": result
+                    }
+                }
+        elif runnable_tool_calls:
+            # run all requested tools at once, results are yielded as they finish
+            with ThreadPoolExecutor(max_workers=min(8, len(runnable_tool_calls))) as executor:
+                futures = {
+                    executor.submit(_run_tool, callable_tools[tc["name"]], tc["arguments"]): tc
+                    for tc in runnable_tool_calls
+                }
+                for future in as_completed(futures):
+                    tool_call = futures[future]
+                    tool_name = tool_call["name"]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"Error executing tool {tool_name}: {e}")
+                        continue
                     yield {
                         "type": "tool_result",
                         "content": {
+                            "id": tool_call["id"],
                             "name": tool_name,
                             "result": result
                         }
                     }
-                    final_tool_calls.remove(tool_call)
-
-                except Exception as e:
-                    print(f"Error executing tool {tool_name}: {e}")
-                    final_tool_calls.remove(tool_call)
-
-            else:
-                yield {"type": "tool_call", "content": tool_call}
 
         if final:
             if hide_thinking or thinking.strip() == "":
@@ -277,7 +692,8 @@ class LLM:
         yield {"type": "done", "content": None}
 
     async def async_response(self, messages: list[dict[str, Any]] = None, output_format: dict = None, tools: list = None,
-                             lm_studio_unload_model: bool = False, hide_thinking: bool = True):
+                             lm_studio_unload_model: bool = False, hide_thinking: bool = True,
+                             request_timeout: float = None, max_retries: int = None):
         """asynchron request model inference"""
         if messages is None:
             raise ValueError("messages must be provided")
@@ -288,184 +704,134 @@ class LLM:
             final=True,
             tools=tools,
             lm_studio_unload_model=lm_studio_unload_model,
-            hide_thinking=hide_thinking
+            hide_thinking=hide_thinking,
+            request_timeout=request_timeout,
+            max_retries=max_retries
         ):
             if r["type"] == "final":
                 return r["content"]
 
     async def async_stream_response(self, messages: list[dict] = None, output_format: dict = None, final: bool = False,
-                                    tools: list = None, lm_studio_unload_model: bool = False, hide_thinking: bool = True
+                                    tools: list = None, lm_studio_unload_model: bool = False, hide_thinking: bool = True,
+                                    request_timeout: float = None, max_retries: int = None,
+                                    stream_batch_size: int = 1, stream_batch_growth: float = 3.0, stream_flush_ms: int = 50
                                     ) -> AsyncGenerator[dict, None]:
         """asynchron request model inference (streaming)"""
-        _tools = list(tools) if tools else []
-        callable_tools = {}
-        if _tools:
-            types = {
-                "str": "string",
-                "int": "integer",
-                "float": "number",
-                "bool": "boolean",
-                "list": "array",
-                "dict": "object"
-            }
-            for i in range(len(_tools)):
-                if callable(_tools[i]):
-                    func = _tools[i]
-                    name = func.__name__.strip()
-                    callable_tools[name] = func
-                    doc = (func.__doc__ or "").strip()
-                    param = func.__annotations__
-                    required_params = []
-                    parameters = {}
-                    for k, v in param.items():
-                        if k == "return":
-                            continue
-                        else:
-                            type_name = getattr(v, "__name__", None)
-                            if type_name is None:
-                                type_name = str(v).split("[", 1)[0].replace("typing.", "").lower()
-                            parameters[str(k)] = {"type": types.get(type_name, "string")}
-                    _tools[i] = {
-                        "type": "function",
-                        "function": {
-                            "name": name,
-                            "description": doc,
-                            "parameters": {
-                                "type": "object",
-                                "properties": parameters,
-                                "required": required_params
-                            }
-                        }
-                    }
-                elif isinstance(_tools[i], dict):
-                    continue
-                else:
-                    raise ValueError("tools must be a list of callables or dicts")
+        _tools, callable_tools = self._translate_tools(tools)
 
         if messages is None:
             raise ValueError("messages must be provided")
 
-        if self.vllm_mode:
-            from PIL import Image
-            for msg in messages:
-                for i in range(len(msg["content"])):
-                    c = msg["content"][i]
-                    if c["type"] == "image":
-                        if "image_path" in c:
-                            with Image.open(c["image_path"]) as img:
-                                buffer = io.BytesIO()
-                                img.save(buffer, format="PNG")
-                            img_b64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
-                            msg["content"][i] = {
-                                "type": "image_url",
-                                "image_url": {"url": f"data:image/png;base64,{img_b64}"}
-                            }
-                        elif "image_pil" in c:
-                            img = c["image_pil"]
-                            buffer = io.BytesIO()
-                            img.save(buffer, format="PNG")
-                            img_b64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
-                            msg["content"][i] = {
-                                "type": "image_url",
-                                "image_url": {"url": f"data:image/png;base64,{img_b64}"}
-                            }
-                        elif "image_url" in c:
-                            url_data = c["image_url"]
-                            if isinstance(url_data, str):
-                                url_data = {"url": url_data}
-                            msg["content"][i] = {"type": "image_url", "image_url": url_data}
+        messages = self._prepare_messages(messages)
 
         if lm_studio_unload_model:
-            import lmstudio as lms
-            lms.configure_default_client(self.base_url)
-            all_loaded_models = lms.list_loaded_models()
-            for loaded_model in (all_loaded_models or []):
-                if loaded_model.identifier != self.model:
-                    loaded_model.unload()
+            lms = _get_lms(self.base_url)
+            all_loaded_models = await asyncio.to_thread(lms.list_loaded_models)
+            stale = [m for m in (all_loaded_models or []) if m.identifier != self.model]
+            await asyncio.gather(*[asyncio.to_thread(m.unload) for m in stale])
 
         structured_output = output_format is not None
+        request_timeout = self.request_timeout if request_timeout is None else request_timeout
+        max_retries = self.max_retries if max_retries is None else max_retries
+        create_kwargs = self._completion_kwargs(messages, _tools, output_format, request_timeout)
 
-        try:
-            if structured_output:
-                create_call = self.async_client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    stream=True,
-                    tools=tools if tools is not None else [],
-                    response_format=output_format if output_format is not None else None,
-                )
-            else:
-                create_call = self.async_client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    stream=True,
-                    tools=tools if tools is not None else [],
-                )
-
-            if asyncio.iscoroutine(create_call):
-                completion = await create_call
-            else:
-                completion = create_call
-
-        except Exception as e:
-            raise RuntimeError(f"Async model request failed: {e}")
-
-        thinking = ""
-        answer = ""
-        tool_calls_accumulator = {}
-        inside_think = False
-
-        async for chunk in completion:
+        for attempt in range(max_retries + 1):
+            try:
+                # timeouts come from the httpx.Timeout in create_kwargs, same as the sync path
+                create_call = self.async_client.chat.completions.create(**create_kwargs)
+                if asyncio.iscoroutine(create_call):
+                    completion = await create_call
+                else:
+                    completion = create_call
+                break
+            except _RETRYABLE_ERRORS as e:
+                if attempt == max_retries:
+                    raise RuntimeError(f"Async model request failed after {attempt + 1} attempts: {e}")
+                await asyncio.sleep(_retry_delay(e, attempt))
+            except Exception as e:
+                raise RuntimeError(f"Async model request failed: {e}")
+
+        thinking_parts = []
+        answer_parts = []
+        tool_names: dict[str, str] = {}
+        tool_arg_chunks: dict[str, list[str]] = {}
+        tool_ids_by_index = {}
+        splitter = _ThinkSplitter()
+        batcher = _StreamBatcher(stream_batch_size, stream_batch_growth, stream_flush_ms)
+
+        async for chunk in _aiter_completion(completion):
+            for batch in batcher.poll():
+                yield batch
             x = chunk.choices[0].delta
             if not x:
                 continue
 
+            # content / tool_calls are always present on openai deltas, reasoning is provider specific
+            content = x.content
+            tool_calls = x.tool_calls
             reasoning = getattr(x, "reasoning", None)
-            content = getattr(x, "content", None)
-            tool_calls = getattr(x, "tool_calls", None)
 
-            if not (content or tool_calls or reasoning):
+            if content is None and tool_calls is None and reasoning is None:
                 continue
 
             if content:
-                if "<think>" in str(content):
-                    inside_think = True
-                    content = str(content).replace("<think>", "")
-                if "</think>" in str(content):
-                    inside_think = False
-                    content = str(content).replace("</think>", "")
-                if inside_think:
-                    thinking += str(content)
-                    if not hide_thinking:
-                        yield {"type": "reasoning", "content": str(content)}
-                else:
-                    answer += str(content)
-                    if not structured_output:
-                        yield {"type": "answer", "content": str(content)}
+                for in_think, text in splitter.feed(str(content)):
+                    if in_think:
+                        thinking_parts.append(text)
+                        if not hide_thinking:
+                            for batch in batcher.add("reasoning", text):
+                                yield batch
+                    else:
+                        answer_parts.append(text)
+                        if not structured_output:
+                            for batch in batcher.add("answer", text):
+                                yield batch
 
             if reasoning:
-                thinking += reasoning
+                thinking_parts.append(reasoning)
                 if not hide_thinking:
-                    yield {"type": "reasoning", "content": reasoning}
+                    for batch in batcher.add("reasoning", reasoning):
+                        yield batch
 
             if tool_calls:
                 for tool_call in tool_calls:
-                    tool_id = tool_call.id or "0"
+                    # the id is usually only sent with the first fragment of a call
+                    tool_id = tool_call.id or tool_ids_by_index.get(tool_call.index) or "0"
+                    tool_ids_by_index[tool_call.index] = tool_id
                     funct = tool_call.function
-                    if tool_id not in tool_calls_accumulator:
-                        tool_calls_accumulator[tool_id] = {"name": funct.name or "", "arguments": ""}
+                    chunks = tool_arg_chunks.get(tool_id)
+                    if chunks is None:
+                        chunks = tool_arg_chunks[tool_id] = []
+                        tool_names[tool_id] = ""
                     if funct.name:
-                        tool_calls_accumulator[tool_id]["name"] = funct.name
+                        tool_names[tool_id] = funct.name
                     if funct.arguments:
                         args_val = funct.arguments
                         if isinstance(args_val, dict):
                             args_val = json.dumps(args_val)
-                        tool_calls_accumulator[tool_id]["arguments"] += args_val or ""
+                        chunks.append(args_val)
+
+        for in_think, text in splitter.flush():
+            if in_think:
+                thinking_parts.append(text)
+                if not hide_thinking:
+                    for batch in batcher.add("reasoning", text):
+                        yield batch
+            else:
+                answer_parts.append(text)
+                if not structured_output:
+                    for batch in batcher.add("answer", text):
+                        yield batch
+        for batch in batcher.flush():
+            yield batch
+
+        thinking = "".join(thinking_parts)
+        answer = "".join(answer_parts)
 
         if structured_output:
             temp_answer = answer
             try:
-                data = json.loads(answer)
+                data = _json_loads(answer)
             except json.JSONDecodeError:
                 try:
                     decoded = answer.encode('utf-8').decode('unicode_escape')
@@ -475,40 +841,47 @@ class LLM:
             answer = data
             yield {"type": "answer", "content": answer}
 
-        final_tool_calls = []
-        for tool_id, data in tool_calls_accumulator.items():
+        final_tool_calls = [None] * len(tool_arg_chunks)
+        for i, (tool_id, chunks) in enumerate(tool_arg_chunks.items()):
+            args_str = "".join(chunks)
             try:
-                args = json.loads(data["arguments"] or "{}")
+                args = _json_loads(args_str or "{}")
             except json.JSONDecodeError:
-                args = {"_raw": data["arguments"] or ""}
-            final_tool_calls.append({"id": tool_id, "name": data["name"], "arguments": args})
-
-        for tool_call in final_tool_calls[:]:
-            tool_name = tool_call["name"]
-
-            if tool_name in callable_tools:
-                try:
-                    func_to_call = callable_tools[tool_name]
-                    if inspect.iscoroutinefunction(func_to_call):
-                        result = await func_to_call(**tool_call["arguments"])
-                    else:
-                        result = func_to_call(**tool_call["arguments"])
-
+                args = {"_raw": args_str}
+            final_tool_calls[i] = {"id": tool_id, "name": tool_names[tool_id], "arguments": args}
+
+        runnable_tool_calls = [tc for tc in final_tool_calls if tc["name"] in callable_tools]
+        final_tool_calls = [tc for tc in final_tool_calls if tc["name"] not in callable_tools]
+
+        for tool_call in final_tool_calls:
+            yield {"type": "tool_call", "content": tool_call}
+
+        if runnable_tool_calls:
+            # run all requested tools at once, results are yielded as they finish
+            # (a single sync tool runs inline, so thread-affine tools keep working)
+            in_thread = len(runnable_tool_calls) > 1
+            tasks = [
+                asyncio.create_task(_async_run_tool(tc, callable_tools[tc["name"]], in_thread))
+                for tc in runnable_tool_calls
+            ]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    tool_call, result, error = await next_done
+                    tool_name = tool_call["name"]
+                    if error is not None:
+                        print(f"Error executing async tool {tool_name}: {error}")
+                        continue
                     yield {
                         "type": "tool_result",
                         "content": {
+                            "id": tool_call["id"],
                             "name": tool_name,
                             "result": result
                         }
                     }
-                    final_tool_calls.remove(tool_call)
-
-                except Exception as e:
-                    print(f"Error executing async tool {tool_name}: {e}")
-                    final_tool_calls.remove(tool_call)
-
-            else:
-                yield {"type": "tool_call", "content": tool_call}
+            finally:
+                for task in tasks:
+                    task.cancel()
 
         if final:
             if hide_thinking or thinking.strip() == "":
@@ -539,19 +912,30 @@ class LLM:
                     }
         yield {"type": "done", "content": None}
 
+    def clear_image_cache(self):
+        """drop all cached vllm_mode image data urls"""
+        self._image_cache.clear()
+
+    def reload_model(self, model: str = None):
+        """drop the cached lm studio model handle, optionally switching to another model"""
+        if model is not None:
+            self.model = model
+        self._lms_model = None
+
+    def _lm_studio_model(self):
+        """return the lm studio handle for self.model, fetched once and cached"""
+        if self._lms_model is None:
+            lms = _get_lms(self.base_url)
+            self._lms_model = lms.llm(self.model)
+        return self._lms_model
+
     def lm_studio_count_tokens(self, input_text: str) -> int:
         """count tokens used in lm studio"""
-        import lmstudio as lms
-        lms.configure_default_client(self.base_url)
         try:
-            model = lms.llm(self.model)
-            tokens = model.tokenize(input_text)
+            tokens = self._lm_studio_model().tokenize(input_text)
             return len(tokens)
         except Exception as e:
             raise RuntimeError(f"Could not count tokens for {self.model}: {e}")
 
     def lm_studio_get_context_length(self) -> int:
-        import lmstudio as lms
-        lms.configure_default_client(self.base_url)
-        model = lms.llm(self.model)
-        return model.get_context_length()
+        return self._lm_studio_model().get_context_length()